@@ -1,5 +1,5 @@
 import streamlit as st
-from graph import graph
+from graph import get_graph
 from state import AgentState
 from memory import (
     get_run_number, 
@@ -7,10 +7,153 @@ from memory import (
     reset_memory, 
     load_memory,
     get_learned_rules,
-    should_follow_learned_behavior
+    should_follow_learned_behavior,
+    memory_version,
+    RUN_HISTORY_WINDOW
 )
+from collections import Counter
 import json
 
+
+# ============================================================================
+# Heavy imports - loaded on first use and shared across reruns
+# ============================================================================
+@st.cache_resource(show_spinner=False)
+def _np():
+    import numpy as np
+    return np
+
+
+@st.cache_resource(show_spinner=False)
+def _pd():
+    import pandas as pd
+    return pd
+
+
+# ============================================================================
+# Memory caching - only re-read agent_memory.json when the file changes
+# load_memory() already returns the parsed dict from memory.py's in-process
+# cache; the views below only cache small values derived from it.
+# ============================================================================
+@st.cache_data(show_spinner=False)
+def _cached_run_number(version: tuple) -> int:
+    return get_run_number()
+
+
+@st.cache_data(show_spinner=False)
+def _cached_has_learned(version: tuple) -> bool:
+    return should_follow_learned_behavior()
+
+
+@st.cache_data(show_spinner=False)
+def _mistake_aggregates(version: tuple) -> tuple:
+    mistake_counts = Counter(load_memory()["aggregates"]["mistake_counts"])
+    return mistake_counts, len(mistake_counts)
+
+
+@st.cache_data(show_spinner=False)
+def _run_stats(version: tuple) -> tuple:
+    aggregates = load_memory()["aggregates"]
+    total_runs = aggregates["total_runs"]
+    successful_runs = aggregates["successful_runs"]
+    success_rate = (successful_runs / total_runs) * 100 if total_runs else 0.0
+    return total_runs, successful_runs, success_rate
+
+
+@st.cache_data(show_spinner=False)
+def _success_stats(version: tuple) -> tuple:
+    np = _np()
+    run_history = load_memory().get("run_history", [])
+    outcomes = np.fromiter(
+        (1 if r.get("success", False) else 0 for r in run_history),
+        dtype=np.int8,
+        count=len(run_history)
+    )
+    return outcomes, int(outcomes.sum()), len(outcomes)
+
+
+def cached_run_number() -> int:
+    return _cached_run_number(memory_version())
+
+
+def cached_has_learned() -> bool:
+    return _cached_has_learned(memory_version())
+
+
+def mistake_aggregates() -> tuple:
+    """(Counter of mistake types, number of unique types)"""
+    return _mistake_aggregates(memory_version())
+
+
+def run_stats() -> tuple:
+    """(total runs, successful runs, success rate %)"""
+    return _run_stats(memory_version())
+
+
+def success_stats() -> tuple:
+    """(0/1 outcome per run in run_history, successes, runs)"""
+    return _success_stats(memory_version())
+
+
+def clear_memory_cache():
+    """Drop all cached memory views (after reset or a new run)"""
+    _cached_run_number.clear()
+    _cached_has_learned.clear()
+    _mistake_aggregates.clear()
+    _run_stats.clear()
+    _success_stats.clear()
+
+
+# ============================================================================
+# Cumulative success rate - kept in session state, extended once per run
+# ============================================================================
+def cumulative_success() -> tuple:
+    """(run numbers, lifetime success rate % after each) for the runs in run_history"""
+    memory = load_memory()
+    run_history = memory.get("run_history", [])
+    last_run = run_history[-1]["run_number"] if run_history else None
+    
+    series = st.session_state.get("cum_success")
+    series_last = series["runs"][-1] if series and series["runs"] else None
+    if series is None or series_last != last_run:
+        # First use in this session, or memory changed elsewhere - rebuild once.
+        # run_history only holds the last RUN_HISTORY_WINDOW runs, so start
+        # from the totals of the runs before it (kept in aggregates).
+        np = _np()
+        outcomes, window_successes, runs = success_stats()
+        aggregates = memory["aggregates"]
+        prior_runs = aggregates["total_runs"] - runs
+        prior_successes = aggregates["successful_runs"] - window_successes
+        rates = (
+            (prior_successes + np.cumsum(outcomes))
+            / (prior_runs + np.arange(1, runs + 1)) * 100
+        ).tolist()
+        series = {
+            "runs": [r["run_number"] for r in run_history],
+            "rates": rates,
+            "successes": aggregates["successful_runs"],
+            "total": aggregates["total_runs"]
+        }
+        st.session_state.cum_success = series
+    return series["runs"], series["rates"]
+
+
+def record_cumulative_success(run_number: int, success: bool):
+    """Extend the session's cumulative success rate by one run"""
+    series = st.session_state.get("cum_success")
+    if series is None:
+        return  # Rebuilt from memory on next read
+    
+    series["total"] += 1
+    series["successes"] += 1 if success else 0
+    series["runs"].append(run_number)
+    series["rates"].append(series["successes"] / series["total"] * 100)
+    
+    # Same window as run_history
+    del series["runs"][:-RUN_HISTORY_WINDOW]
+    del series["rates"][:-RUN_HISTORY_WINDOW]
+
+
 st.set_page_config(
     page_title="Finance Research Agent",
     page_icon="📈",
@@ -21,7 +164,9 @@ st.title("📈 Self-Improving Finance Agent")
 st.markdown("*An AI agent that learns from its mistakes over time*")
 
 # Sidebar - Memory Status
-with st.sidebar:
+@st.fragment
+def sidebar_memory():
+    """Sidebar memory panel - its widgets rerun only this fragment"""
     st.header("🧠 Agent Memory")
     
     memory = load_memory()
@@ -32,9 +177,7 @@ with st.sidebar:
     # ✅ NEW: Calculate and display success rate
     run_history = memory.get("run_history", [])
     if run_history:
-        total_runs = len(run_history)
-        successful_runs = sum(1 for r in run_history if r.get("success", False))
-        success_rate = (successful_runs / total_runs) * 100
+        total_runs, successful_runs, success_rate = run_stats()
         
         st.metric(
             "Success Rate", 
@@ -43,12 +186,10 @@ with st.sidebar:
         )
         
         # ✅ NEW: Show improvement over time
-        if total_runs >= 4:
-            early_runs = run_history[:2]
-            recent_runs = run_history[-2:]
-            
-            early_success = sum(1 for r in early_runs if r.get("success", False)) / len(early_runs)
-            recent_success = sum(1 for r in recent_runs if r.get("success", False)) / len(recent_runs)
+        outcomes, _, history_runs = success_stats()
+        if history_runs >= 4:
+            early_success = outcomes[:2].mean()
+            recent_success = outcomes[-2:].mean()
             
             improvement = (recent_success - early_success) * 100
             
@@ -62,18 +203,21 @@ with st.sidebar:
     
     if st.button("🔄 Reset Memory", help="Clear all learning history"):
         reset_memory()
+        clear_memory_cache()
+        st.session_state.pop("cum_success", None)
         st.success("Memory reset!")
         st.rerun()
     
     st.markdown("---")
     
     # Show learned rules
-    learned_rules = get_learned_rules()
+    learned_rules = get_learned_rules(memory)
     if learned_rules:
         st.subheader("📚 Learned Rules")
-        for rule in learned_rules:
-            if rule:
-                st.success(f"✓ {rule.get('description', 'Unknown rule')}")
+        # One widget for all rules ("  \n" is a markdown line break)
+        st.success("  \n".join(
+            f"✓ {rule.get('description', 'Unknown rule')}" for rule in learned_rules if rule
+        ))
     else:
         st.info("No rules learned yet")
     
@@ -82,13 +226,15 @@ with st.sidebar:
     # Show past mistakes
     if memory.get("mistakes"):
         st.subheader("Past Mistakes")
-        for m in memory["mistakes"][-5:]:  # Last 5
-            st.caption(f"Run {m['run_number']}: {m['mistake_type']}")
+        st.caption("\n\n".join(
+            f"Run {m['run_number']}: {m['mistake_type']}"
+            for m in memory["mistakes"][-5:]  # Last 5
+        ))
     
     st.markdown("---")
     
     # Dynamic status message
-    has_learned = should_follow_learned_behavior()
+    has_learned = cached_has_learned()
     if has_learned:
         st.markdown("""
         **Current Status:**
@@ -102,6 +248,118 @@ with st.sidebar:
         ⚠️ May make mistakes to learn
         """)
 
+
+# Results of a single agent run
+@st.fragment
+def results_panel(result):
+    """Report, evaluation and history for a finished run"""
+    # Display results in columns
+    col_left, col_right = st.columns([2, 1])
+    
+    with col_left:
+        st.markdown("### 📊 Final Report")
+        if result["success"]:
+            st.success("✅ Run Successful")
+        else:
+            st.error("❌ Run Failed")
+        
+        st.markdown(result["final_report"])
+    
+    with col_right:
+        st.markdown("### 🛠️ Tools Used")
+        st.code("\n".join(f"✓ {tool}" for tool in result["tools_used"]), language=None)
+        
+        st.markdown("### 🔍 Evaluation")
+        st.metric("Run Number", result["run_number"])
+        
+        if result["mistake_type"]:
+            st.error(f"**Mistake:** {result['mistake_type']}")
+            with st.expander("Explanation"):
+                st.write(result["mistake_explanation"])
+        else:
+            st.success("No mistakes - correct execution!")
+        
+        # Show learning status after this run
+        st.markdown("---")
+        st.markdown("### 🧠 Learning Status")
+        
+        # Reload memory to get latest
+        updated_memory = load_memory()
+        learned_after = get_learned_rules(updated_memory)
+        
+        if learned_after:
+            st.info(f"Agent has learned {len(learned_after)} rule(s)")
+        else:
+            mistakes_count = len(updated_memory.get("mistakes", []))
+            st.warning(f"{mistakes_count} mistake(s) recorded - need 2 of same type to learn")
+    
+    # ✅ NEW: Show learning progress with metrics
+    st.markdown("---")
+    st.markdown("### 📈 Learning Progress")
+    
+    # Show mistake pattern analysis
+    mistake_counts, diversity = mistake_aggregates()
+    if mistake_counts:
+        
+        col_a, col_b, col_c = st.columns(3)
+        
+        with col_a:
+            st.markdown("**Mistake Frequency:**")
+            st.code("\n".join(
+                f"{mtype}: {count}x" + ("  → Rule created ✓" if count >= 2 else "")
+                for mtype, count in mistake_counts.items()
+            ), language=None)
+        
+        with col_b:
+            st.markdown("**Learning Trigger:**")
+            st.info("Rule created after same mistake occurs 2 times")
+        
+        with col_c:
+            st.markdown("**Mistake Diversity:**")
+            st.metric("Unique Mistake Types", diversity)
+    
+    # ✅ NEW: Run history table with enhanced metrics
+    memory = load_memory()
+    if memory.get("run_history"):
+        st.markdown("---")
+        st.markdown("### 📋 Run History")
+        
+        np = _np()
+        pd = _pd()
+        
+        # Build the table column-wise instead of one dict per run
+        runs = pd.DataFrame.from_records(
+            memory["run_history"],
+            columns=["run_number", "success", "tools_used", "mistake"]
+        )
+        success = runs["success"].fillna(False).astype(bool).to_numpy()
+        history_df = pd.DataFrame({
+            "Run": runs["run_number"],
+            "Success": np.where(success, "✅", "❌"),
+            "Tools Used": runs["tools_used"].str.len().fillna(0).astype(int),
+            "Mistake": runs["mistake"]
+        })
+        
+        st.dataframe(history_df, use_container_width=True)
+        
+        # ✅ NEW: Visual success rate chart
+        if len(history_df) >= 3:
+            st.markdown("#### Success Rate Over Time")
+            
+            # Cumulative success rate, maintained incrementally per session
+            run_numbers, cum_success = cumulative_success()
+            
+            chart_data = pd.DataFrame({
+                "Run": run_numbers,
+                "Success Rate (%)": cum_success
+            })
+            
+            st.line_chart(chart_data.set_index("Run"))
+
+
+with st.sidebar:
+    sidebar_memory()
+
 # Main interface
 st.markdown("### Ask about any company")
 
@@ -117,8 +375,8 @@ with col1:
     run_button = st.button("🚀 Run Agent", type="primary", use_container_width=True)
 
 with col2:
-    next_run = get_run_number()
-    has_learned = should_follow_learned_behavior()
+    next_run = cached_run_number()
+    has_learned = cached_has_learned()
     
     if has_learned:
         st.success(f"Run #{next_run} - Learned ✓")
@@ -127,132 +385,16 @@ with col2:
 
 if run_button and query:
     # Initialize state
-    initial_state: AgentState = {
-        "user_query": query,
-        "run_number": 0,
-        "should_make_mistake": False,
-        "tools_used": [],
-        "tool_outputs": {},
-        "final_report": None,
-        "success": False,
-        "mistake_type": None,
-        "mistake_explanation": None,
-        "past_mistakes": []
-    }
+    initial_state = AgentState(user_query=query)
     
     # Run the agent
     with st.spinner("🤖 Agent is working..."):
         try:
-            result = graph.invoke(initial_state)
-            
-            # Display results in columns
-            col_left, col_right = st.columns([2, 1])
-            
-            with col_left:
-                st.markdown("### 📊 Final Report")
-                if result["success"]:
-                    st.success("✅ Run Successful")
-                else:
-                    st.error("❌ Run Failed")
-                
-                st.markdown(result["final_report"])
-            
-            with col_right:
-                st.markdown("### 🛠️ Tools Used")
-                for tool in result["tools_used"]:
-                    st.text(f"✓ {tool}")
-                
-                st.markdown("### 🔍 Evaluation")
-                st.metric("Run Number", result["run_number"])
-                
-                if result["mistake_type"]:
-                    st.error(f"**Mistake:** {result['mistake_type']}")
-                    with st.expander("Explanation"):
-                        st.write(result["mistake_explanation"])
-                else:
-                    st.success("No mistakes - correct execution!")
-                
-                # Show learning status after this run
-                st.markdown("---")
-                st.markdown("### 🧠 Learning Status")
-                
-                # Reload memory to get latest
-                updated_memory = load_memory()
-                learned_after = get_learned_rules()
-                
-                if learned_after:
-                    st.info(f"Agent has learned {len(learned_after)} rule(s)")
-                else:
-                    mistakes_count = len(updated_memory.get("mistakes", []))
-                    st.warning(f"{mistakes_count} mistake(s) recorded - need 2 of same type to learn")
-            
-            # ✅ NEW: Show learning progress with metrics
-            st.markdown("---")
-            st.markdown("### 📈 Learning Progress")
-            
-            # Show mistake pattern analysis
-            from collections import Counter
-            mistakes = load_memory().get("mistakes", [])
-            if mistakes:
-                mistake_types = [m["mistake_type"] for m in mistakes]
-                mistake_counts = Counter(mistake_types)
-                
-                col_a, col_b, col_c = st.columns(3)
-                
-                with col_a:
-                    st.markdown("**Mistake Frequency:**")
-                    for mtype, count in mistake_counts.items():
-                        st.text(f"{mtype}: {count}x")
-                        if count >= 2:
-                            st.caption("→ Rule created ✓")
-                
-                with col_b:
-                    st.markdown("**Learning Trigger:**")
-                    st.info("Rule created after same mistake occurs 2 times")
-                
-                with col_c:
-                    st.markdown("**Mistake Diversity:**")
-                    diversity = len(mistake_counts)
-                    st.metric("Unique Mistake Types", diversity)
-            
-            # ✅ NEW: Run history table with enhanced metrics
-            memory = load_memory()
-            if memory.get("run_history"):
-                st.markdown("---")
-                st.markdown("### 📋 Run History")
-                
-                history_data = []
-                for run in memory["run_history"]:
-                    history_data.append({
-                        "Run": run["run_number"],
-                        "Success": "✅" if run["success"] else "❌",
-                        "Tools Used": len(run.get("tools_used", [])),
-                        "Mistake": run.get("mistake", "None")
-                    })
-                
-                st.dataframe(history_data, use_container_width=True)
-                
-                # ✅ NEW: Visual success rate chart
-                if len(history_data) >= 3:
-                    st.markdown("#### Success Rate Over Time")
-                    
-                    # Calculate rolling success rate
-                    import pandas as pd
-                    df = pd.DataFrame(history_data)
-                    df["Success_Binary"] = df["Success"].apply(lambda x: 1 if x == "✅" else 0)
-                    
-                    # Simple line chart showing cumulative success rate
-                    cumulative_success = []
-                    for i in range(1, len(df) + 1):
-                        rate = df["Success_Binary"][:i].sum() / i * 100
-                        cumulative_success.append(rate)
-                    
-                    chart_data = pd.DataFrame({
-                        "Run": list(range(1, len(df) + 1)),
-                        "Success Rate (%)": cumulative_success
-                    })
-                    
-                    st.line_chart(chart_data.set_index("Run"))
+            cumulative_success()  # Seed before the run so it can be extended
+            result = get_graph().invoke(initial_state.to_dict())
+            clear_memory_cache()
+            record_cumulative_success(result["run_number"], result["success"])
+            results_panel(result)
         
         except Exception as e:
             st.error(f"Error: {str(e)}")
@@ -268,9 +410,9 @@ with st.expander("ℹ️ How It Works"):
        - Mistake recorded but **no rule yet** (need 2 occurrences)
        - After run 2: If same mistake → Rule created ✓
     
-    2. **Run 3+**: Agent follows learned rules with enhanced prompt
-       - Explicit constraints added to prompt
-       - Temperature reduced to 0 for deterministic execution
+    2. **Run 3+**: Agent follows learned rules
+       - Learned rules pin the full tool sequence (all data first, report last)
+       - The planner LLM call is skipped - execution is deterministic
        - Should succeed consistently
     
     3. **Prompt Variations**: System rotates through 3 weak prompt styles:
@@ -286,8 +428,8 @@ with st.expander("ℹ️ How It Works"):
     ### Key Insights:
     - Rules only created after **same mistake occurs 2 times**
     - Mistakes are **natural** - emerge from weak prompts, not hardcoded
-    - Temperature variation (0.4 → 0) creates learning progression
-    - System genuinely improves by strengthening prompts with learned constraints
+    - Early runs plan with the LLM at temperature 0.4 to surface varied mistakes
+    - System genuinely improves by turning learned constraints into the tool plan
     
     ### Demo:
     1. Reset Memory → Run 5-6 queries → Watch improvement!
@@ -296,8 +438,13 @@ with st.expander("ℹ️ How It Works"):
 
 # Footer
 st.markdown("---")
-st.caption("🔬 Assignment Demo - Self-Improving AI Agent with LangGraph | Memory stored in: agent_memory.json")
+st.caption("🔬 Assignment Demo - Self-Improving AI Agent with LangGraph | Memory stored in: agent_memory.json, agent_runs.jsonl, agent_mistakes.jsonl")
 
 # ✅ NEW: Debug section (hide in production)
-if st.checkbox("🐛 Show Memory Debug", value=False):
-    st.json(load_memory())
\ No newline at end of file
+@st.fragment
+def memory_debug():
+    if st.checkbox("🐛 Show Memory Debug", value=False):
+        st.json(load_memory())
+
+
+memory_debug()
\ No newline at end of file
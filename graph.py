@@ -1,14 +1,13 @@
 from langgraph.graph import StateGraph, END
+import streamlit as st
 from state import AgentState
 from tools import (
-    search_company_overview,
-    search_stock_price,
-    search_recent_news,
-    search_financial_metrics,
     analyze_sentiment,
-    generate_report
+    generate_report,
+    gather_company_data
 )
 from memory import (
+    load_memory,
     get_run_number,
     get_past_mistakes,
     analyze_patterns,
@@ -18,25 +17,105 @@ from memory import (
     get_required_tools,
     validate_execution
 )
+from langchain_groq import ChatGroq
+from functools import lru_cache
 import os
 import random
+import re
 
 os.environ["LANGCHAIN_TRACING_V2"] = "true"
 os.environ["LANGCHAIN_PROJECT"] = os.getenv("LANGSMITH_PROJECT", "finance-agent")
 
+# Tool names the agent is allowed to plan
+_VALID_TOOLS: frozenset[str] = frozenset({
+    "search_company_overview",
+    "search_stock_price",
+    "search_recent_news",
+    "search_financial_metrics",
+    "analyze_sentiment",
+    "generate_report"
+})
+
+# Tools every run must call before generate_report, in pipeline order
+_REQUIRED_TOOL_ORDER: tuple[str, ...] = (
+    "search_company_overview",
+    "search_stock_price",
+    "search_recent_news",
+    "search_financial_metrics"
+)
+_REQUIRED_TOOLS: frozenset[str] = frozenset(_REQUIRED_TOOL_ORDER)
+
+# Bullets and list numbering the LLM puts in front of tool names
+_STRIP_RE = re.compile(r"[-*•>]|\d+\.")
+
+# Canonical sequence the strong prompt asks for once rules are learned
+_LEARNED_TOOL_PLAN = (
+    "search_company_overview",
+    "search_stock_price",
+    "search_recent_news",
+    "search_financial_metrics",
+    "analyze_sentiment",
+    "generate_report"
+)
 
-def initialize_node(state: AgentState) -> AgentState:
+# Rules that _LEARNED_TOOL_PLAN already satisfies
+_FULL_SEQUENCE_RULES = frozenset({
+    "must_use_all_required_tools",
+    "collect_before_generate",
+    "use_collected_data"
+})
+
+# Search tool name -> tool_outputs key. Searches all run up front through
+# gather_company_data (cached in tools.py - only successful searches are kept).
+SEARCH_OUTPUT_KEYS = {
+    "search_company_overview": "overview",
+    "search_stock_price": "price",
+    "search_recent_news": "news",
+    "search_financial_metrics": "financials",
+}
+
+# Tool name -> (tool_outputs key, call) for tools that depend on earlier
+# outputs. A call returning None is skipped.
+TOOL_DISPATCH = {
+    "analyze_sentiment": (
+        "sentiment",
+        lambda company, outputs: (
+            analyze_sentiment.invoke(outputs["news"]) if "news" in outputs else None
+        )
+    ),
+    "generate_report": (
+        "report",
+        lambda company, outputs: generate_report.invoke({
+            "company": company,
+            "collected_data": outputs
+        })
+    ),
+}
+
+
+@lru_cache(maxsize=2)
+def _llm(temperature: float) -> ChatGroq:
+    """One shared client per temperature (learned runs use 0, early runs 0.4)"""
+    return ChatGroq(
+        model="llama-3.1-8b-instant",
+        temperature=temperature,
+        api_key=os.getenv("GROQ_API_KEY")
+    )
+
+
+def initialize_node(state: AgentState) -> dict:
     """Initialize the run with memory context"""
-    run_num = get_run_number()
-    has_learned = should_follow_learned_behavior()
-    past = get_past_mistakes()
+    memory = load_memory()
+    run_num = get_run_number(memory)
+    has_learned = should_follow_learned_behavior(memory)
+    past = get_past_mistakes(memory)
     
     print(f"\n{'='*60}")
-    print(f"RUN #{run_num}: {state['user_query']}")
+    print(f"RUN #{run_num}: {state.user_query}")
     print(f"Has Learned Rules: {has_learned}")
     
     if has_learned:
-        rules = get_learned_rules()
+        rules = get_learned_rules(memory)
         print(f"Active Rules: {len(rules)}")
         for rule in rules:
             if rule:
@@ -45,13 +124,12 @@ def initialize_node(state: AgentState) -> AgentState:
         print("Learning Mode: May make natural mistakes")
     
     if past:
-        patterns = analyze_patterns()
+        patterns = analyze_patterns(memory)
         if patterns:
             print(f"Patterns: {', '.join(patterns)}")
     print(f"{'='*60}\n")
     
     return {
-        **state,
         "run_number": run_num,
         "should_make_mistake": not has_learned,
         "tools_used": [],
@@ -64,22 +142,12 @@ def initialize_node(state: AgentState) -> AgentState:
 # ============================================================================
 # ✅ FIX #1: PROMPT ROTATION - Multiple weak prompt variations
 # ============================================================================
-def build_system_prompt(run_number: int) -> str:
-    """
-    Build system prompt based on learned rules.
-    WEAK PROMPTS (early) = 3 different variations → varied natural mistakes
-    STRONG PROMPT (after learning) = explicit rules → better behavior
-    """
-    
-    learned_rules = get_learned_rules()
-    
-    if not learned_rules:
-        # ✅ THREE DIFFERENT WEAK PROMPT VARIATIONS
-        # Each biases toward different mistake types     
-        weak_prompts = {
-      
-            # VARIATION A: Wrong tool sequence → generate_report called early
-            0:"""You are a HASTY finance assistant who jumps to conclusions.
+# ✅ THREE DIFFERENT WEAK PROMPT VARIATIONS
+# Each biases toward different mistake types     
+_WEAK_PROMPTS = {
+
+    # VARIATION A: Wrong tool sequence → generate_report called early
+    0:"""You are a HASTY finance assistant who jumps to conclusions.
 
 Available tools:
 - search_company_overview: Basic company info
@@ -103,8 +171,8 @@ ALWAYS follow this exact sequence:
 
 This creates a wrong tool sequence where the report comes before complete data gathering.""" ,
 
-            # VARIATION B: News-skipper → different mistake type (skipped_required_tool)
-            1:"""You are a FUNDAMENTALS-FOCUSED finance assistant who values hard data over noise.
+    # VARIATION B: News-skipper → different mistake type (skipped_required_tool)
+    1:"""You are a FUNDAMENTALS-FOCUSED finance assistant who values hard data over noise.
 
 Available tools:
 - search_company_overview (essential - business model)
@@ -126,8 +194,8 @@ SKIP the news - it's usually short-term noise, speculation, and emotional reacti
 
 Always end with generate_report using the concrete data you collected.""" ,
 
-            # VARIATION C: Speed-focused → likely skips financial_metrics BUT always generates report
-            2: """You are a SPEED-OPTIMIZED finance assistant. Users want fast answers.
+    # VARIATION C: Speed-focused → likely skips financial_metrics BUT always generates report
+    2: """You are a SPEED-OPTIMIZED finance assistant. Users want fast answers.
 
 Available tools:
 - search_company_overview (quick, essential)
@@ -146,8 +214,8 @@ RULE: Always call generate_report as your final step, even if you skipped some d
 
 Remember: Fast good decisions beat slow perfect ones. Most investment calls don't need exhaustive financial analysis.""",
 
-            # VARIATION D: Minimalist → skips financial_metrics (same as Speed but different framing)
-            3: """You are a MINIMALIST finance assistant who avoids over-analysis.
+    # VARIATION D: Minimalist → skips financial_metrics (same as Speed but different framing)
+    3: """You are a MINIMALIST finance assistant who avoids over-analysis.
 
 Available tools:
 - search_company_overview (essential basics)
@@ -168,18 +236,32 @@ Efficient Analysis Method:
 Financial metrics are exhaustive (P/E, revenue, margins, cash flow...) but often overwhelming and unnecessary. Most investment decisions can be made with overview + price + news context.
 
 Save time: Skip the detailed financials unless absolutely critical. Always finish with generate_report."""
-        }
-        
+}
+
+_PROMPT_NAMES = ['Report-Early', 'News-Skipper', 'Speed', 'Minimalist']
+
+
+def build_system_prompt(run_number: int, memory=None) -> str:
+    """
+    Build system prompt based on learned rules.
+    WEAK PROMPTS (early) = 3 different variations → varied natural mistakes
+    STRONG PROMPT (after learning) = explicit rules → better behavior
+    """
+    
+    learned_rules = get_learned_rules(memory)
+    
+    if not learned_rules:
         # Rotate based on run number (4 variations now)
-        prompt_index = (run_number - 1) % 4
-        prompt_names = ['Report-Early', 'News-Skipper', 'Speed', 'Minimalist']
-        selected_prompt = weak_prompts[prompt_index]
+        prompt_index = (run_number - 1) % len(_WEAK_PROMPTS)
+        selected_prompt = _WEAK_PROMPTS[prompt_index]
         
-        print(f"  🎲 Using Prompt Variation {prompt_index} ({prompt_names[prompt_index]})")
+        print(f"  🎲 Using Prompt Variation {prompt_index} ({_PROMPT_NAMES[prompt_index]})")
         
         return selected_prompt
     
     # ✅ STRONG PROMPT - with learned constraints
+    # Only reached for rules outside _FULL_SEQUENCE_RULES, i.e. hand-edited
+    # memory files - every rule create_learning_rule makes skips the planner
     base_prompt = """You are a THOROUGH finance research assistant analyzing companies for investment decisions.
 
 Your task: Provide comprehensive, well-researched investment analysis.
@@ -204,37 +286,19 @@ Available tools:
     return base_prompt + rules_text
 
 
-def execute_agent_node(state: AgentState) -> AgentState:
-    """
-    Simple LLM-based agent that decides which tools to call.
-    Early runs: weak prompt variations → different natural mistakes
-    Later runs: strong prompt with learned rules → consistent success
-    """
-    from langchain_groq import ChatGroq
-    
-    company = state["user_query"]
-    run_number = state["run_number"]
-    has_learned = should_follow_learned_behavior()
-    
+def _plan_tools(company: str, run_number: int, memory, has_learned: bool) -> list:
+    """Ask the planner LLM which tools to call, in order"""
     # ✅ FIX #1: Pass run_number to build_system_prompt
-    system_prompt = build_system_prompt(run_number)
-    
-    if has_learned:
-        print("✅ Agent has learned rules - using enhanced prompt...")
-    else:
-        print("⚠️ Early learning phase - using weak prompt variant...")
+    system_prompt = build_system_prompt(run_number, memory)
     
     # ✅ FIX #2: INCREASED TEMPERATURE (0.2 → 0.4)
     # Higher temp = more varied decisions = different mistakes
-    llm = ChatGroq(
-        model="llama-3.1-8b-instant",
-        temperature=0 if has_learned else 0.4,  # ← CHANGED from 0.2
-        api_key=os.getenv("GROQ_API_KEY")
-    )
+    llm = _llm(0 if has_learned else 0.4)  # ← CHANGED from 0.2
     
     # ✅ FIX #3: BETTER LLM INSTRUCTION FORMAT
     if has_learned:
-        # Strict, explicit instructions when rules exist
+        # Strict, explicit instructions when rules exist (hand-edited rules only,
+        # see execute_agent_node)
         decision_prompt = f"""{system_prompt}
 
 Company to analyze: {company}
@@ -269,33 +333,56 @@ AVAILABLE TOOLS:
 
 YOUR TOOL LIST:"""
 
-    try:
-        # Get LLM's decision
-        response = llm.invoke(decision_prompt)
-        tool_response = response.content.strip()
-        
-        # Parse tool names - handle various formats
-        tool_plan = []
-        valid_tools = [
-            'search_company_overview', 
-            'search_stock_price', 
-            'search_recent_news', 
-            'search_financial_metrics',
-            'analyze_sentiment', 
-            'generate_report'
-        ]
+    # Get LLM's decision
+    response = llm.invoke(decision_prompt)
+    tool_response = response.content.strip()
+    
+    # Parse tool names - handle various formats
+    tool_plan = []
+    
+    for line in tool_response.split('\n'):
+        # Clean line in a single regex pass
+        cleaned = _STRIP_RE.sub('', line).strip()
         
-        for line in tool_response.split('\n'):
-            # Clean line
-            line = line.strip()
-            line = line.replace('-', '').replace('*', '').replace('•', '').replace('>', '')
-            line = line.replace('1.', '').replace('2.', '').replace('3.', '')
-            line = line.replace('4.', '').replace('5.', '').replace('6.', '')
-            line = line.strip()
-            
-            # Check if it's a valid tool name
-            if line in valid_tools:
-                tool_plan.append(line)
+        # Check if it's a valid tool name
+        if cleaned in _VALID_TOOLS:
+            tool_plan.append(cleaned)
+    
+    return tool_plan
+
+
+def execute_agent_node(state: AgentState) -> dict:
+    """
+    Simple LLM-based agent that decides which tools to call.
+    Early runs: weak prompt variations → different natural mistakes
+    Later runs: learned rules pin the full tool sequence → consistent success
+    """
+    company = state.user_query
+    run_number = state.run_number
+    memory = load_memory()
+    has_learned = should_follow_learned_behavior(memory)
+    
+    # Decide the plan first - the prompt and client are only built when the
+    # planner LLM is actually called
+    learned_rule_names = {rule.get("rule") for rule in get_learned_rules(memory) if rule}
+    use_learned_plan = has_learned and learned_rule_names <= _FULL_SEQUENCE_RULES
+    
+    if use_learned_plan:
+        print("✅ Agent has learned rules - following the learned tool sequence...")
+    elif has_learned:
+        # Only for hand-edited memory files - every rule create_learning_rule
+        # produces is in _FULL_SEQUENCE_RULES
+        print("✅ Agent has learned rules - using enhanced prompt...")
+    else:
+        print("⚠️ Early learning phase - using weak prompt variant...")
+    
+    try:
+        if use_learned_plan:
+            # Learned rules pin the full sequence - no need to ask the LLM
+            tool_plan = list(_LEARNED_TOOL_PLAN)
+            print("  ⚡ Learned rules cover the full sequence - skipping planner LLM call")
+        else:
+            tool_plan = _plan_tools(company, run_number, memory, has_learned)
         
         # ✅ SAFETY: Ensure generate_report is always included (if not already)
         if 'generate_report' not in tool_plan and not has_learned:
@@ -309,48 +396,26 @@ YOUR TOOL LIST:"""
         tools_used = []
         tool_outputs = {}
         
+        # Searches only depend on the company - run them concurrently up
+        # front, then record them in plan order below
+        prefetched = gather_company_data(
+            company,
+            [name for name in dict.fromkeys(tool_plan) if name in SEARCH_OUTPUT_KEYS]
+        )
+        
         for tool_name in tool_plan:
-            tool_name_clean = tool_name.strip()
+            if tool_name in prefetched:
+                output_key = SEARCH_OUTPUT_KEYS[tool_name]
+                result = prefetched[tool_name]
+            else:
+                output_key, call = TOOL_DISPATCH[tool_name]
+                result = call(company, tool_outputs)
+            if result is None:
+                continue
             
-            if tool_name_clean == "search_company_overview":
-                result = search_company_overview.invoke(company)
-                tools_used.append("search_company_overview")
-                tool_outputs["overview"] = result
-                print(f"  ✓ Called: search_company_overview")
-                
-            elif tool_name_clean == "search_stock_price":
-                result = search_stock_price.invoke(company)
-                tools_used.append("search_stock_price")
-                tool_outputs["price"] = result
-                print(f"  ✓ Called: search_stock_price")
-                
-            elif tool_name_clean == "search_recent_news":
-                result = search_recent_news.invoke(company)
-                tools_used.append("search_recent_news")
-                tool_outputs["news"] = result
-                print(f"  ✓ Called: search_recent_news")
-                
-            elif tool_name_clean == "search_financial_metrics":
-                result = search_financial_metrics.invoke(company)
-                tools_used.append("search_financial_metrics")
-                tool_outputs["financials"] = result
-                print(f"  ✓ Called: search_financial_metrics")
-                
-            elif tool_name_clean == "analyze_sentiment":
-                if "news" in tool_outputs:
-                    result = analyze_sentiment.invoke(tool_outputs["news"])
-                    tools_used.append("analyze_sentiment")
-                    tool_outputs["sentiment"] = result
-                    print(f"  ✓ Called: analyze_sentiment")
-                    
-            elif tool_name_clean == "generate_report":
-                result = generate_report.invoke({
-                    "company": company,
-                    "collected_data": tool_outputs
-                })
-                tools_used.append("generate_report")
-                tool_outputs["report"] = result
-                print(f"  ✓ Called: generate_report")
+            tools_used.append(tool_name)
+            tool_outputs[output_key] = result
+            print(f"  ✓ Called: {tool_name}")
         
         # Get final report
         if "report" in tool_outputs:
@@ -375,7 +440,6 @@ YOUR TOOL LIST:"""
         mistake_explanation = str(e)
     
     return {
-        **state,
         "tools_used": tools_used,
         "tool_outputs": tool_outputs,
         "final_report": report,
@@ -385,56 +449,49 @@ YOUR TOOL LIST:"""
     }
 
 
-def evaluator_node(state: AgentState) -> AgentState:
+def evaluator_node(state: AgentState) -> dict:
     """
     Evaluate the run and record to memory.
     This triggers the learning mechanism.
     """
     # Even if execution succeeded, check for logical mistakes
-    tools_used = state["tools_used"]
-    tool_outputs = state["tool_outputs"]
+    tools_used = state.tools_used
+    tool_outputs = state.tool_outputs
+    tools_used_set = set(tools_used)
     
-    # Required tools for proper analysis
-    required_tools = ["search_company_overview", "search_stock_price", 
-                     "search_recent_news", "search_financial_metrics"]
-    
-    success = state["success"]
-    mistake_type = state["mistake_type"]
-    mistake_explanation = state["mistake_explanation"]
+    success = state.success
+    mistake_type = state.mistake_type
+    mistake_explanation = state.mistake_explanation
     
     # Check 1: Was report even generated?
-    if "generate_report" not in tools_used:
+    if "generate_report" not in tools_used_set:
         success = False
         mistake_type = "wrong_tool_sequence"
         mistake_explanation = "Failed to call generate_report - no final analysis provided"
     
     # Check 2: Missing required tools?
     elif success:  # Only check if no error yet
-        missing_tools = [tool for tool in required_tools if tool not in tools_used]
+        missing = _REQUIRED_TOOLS - tools_used_set
+        missing_tools = [tool for tool in _REQUIRED_TOOL_ORDER if tool in missing]
         if missing_tools:
             success = False
             mistake_type = "skipped_required_tool"
             mistake_explanation = f"Missing required tools: {', '.join(missing_tools)}"
     
     # Check 3: Was report called before gathering all data?
-    if "generate_report" in tools_used and success:
-        report_index = tools_used.index("generate_report")
-        tools_before_report = tools_used[:report_index]
+    if "generate_report" in tools_used_set and success:
+        tools_before_report = set(tools_used[:tools_used.index("generate_report")])
         
-        missing_before_report = [tool for tool in required_tools if tool not in tools_before_report]
+        missing = _REQUIRED_TOOLS - tools_before_report
+        missing_before_report = [tool for tool in _REQUIRED_TOOL_ORDER if tool in missing]
         if missing_before_report:
             success = False
             mistake_type = "wrong_tool_sequence"
             mistake_explanation = f"Called report before gathering: {', '.join(missing_before_report)}"
     
-    # Update state with evaluation
-    state["success"] = success
-    state["mistake_type"] = mistake_type
-    state["mistake_explanation"] = mistake_explanation
-    
     # Record this run - THIS IS WHERE LEARNING HAPPENS
     record_run({
-        "query": state["user_query"],
+        "query": state.user_query,
         "tools_used": tools_used,
         "success": success,
         "mistake": mistake_type,
@@ -442,14 +499,19 @@ def evaluator_node(state: AgentState) -> AgentState:
     })
     
     if success:
-        print(f"\n✅ Run #{state['run_number']} PASSED")
+        print(f"\n✅ Run #{state.run_number} PASSED")
     else:
-        print(f"\n❌ Run #{state['run_number']} FAILED")
+        print(f"\n❌ Run #{state.run_number} FAILED")
         print(f"   Mistake: {mistake_type}")
         print(f"   Reason: {mistake_explanation}")
         print(f"   📚 Recording for learning...")
     
-    return state
+    # Update state with evaluation
+    return {
+        "success": success,
+        "mistake_type": mistake_type,
+        "mistake_explanation": mistake_explanation
+    }
 
 
 def create_graph():
@@ -470,5 +532,8 @@ def create_graph():
     return workflow.compile()
 
 
-graph = create_graph()
+@st.cache_resource
+def get_graph():
+    """Compiled workflow shared across Streamlit sessions and reruns"""
+    return create_graph()
 
@@ -1,10 +1,32 @@
+import copy
 import json
+import logging
 import os
 from datetime import datetime
 from collections import Counter
 
+try:
+    import orjson
+except ImportError:  # stdlib fallback
+    orjson = None
+
 # Get absolute path to ensure we know where file is saved
-MEMORY_FILE = os.path.join(os.getcwd(), "agent_memory.json")
+_MEMORY_DIR = os.getcwd()
+MEMORY_FILE = os.path.join(_MEMORY_DIR, "agent_memory.json")
+
+# Append-only streams, one JSON object per line. MEMORY_FILE only keeps
+# the small fields (total_runs, learned_rules, aggregates).
+RUNS_FILE = os.path.join(_MEMORY_DIR, "agent_runs.jsonl")
+MISTAKES_FILE = os.path.join(_MEMORY_DIR, "agent_mistakes.jsonl")
+
+# memory key -> file holding that list
+_STREAM_FILES = {"run_history": RUNS_FILE, "mistakes": MISTAKES_FILE}
+
+# ⚠️ FIX: Ensure directory exists (once, not on every save)
+os.makedirs(_MEMORY_DIR, exist_ok=True)
+
+# Only the most recent runs are kept in full - totals live in aggregates
+RUN_HISTORY_WINDOW = 500
 
 # Learning threshold - how many times a mistake must occur before creating a rule
 LEARNING_THRESHOLD = 2
@@ -12,94 +34,305 @@ LEARNING_THRESHOLD = 2
 # ⚠️ ADD: Debug flag
 DEBUG = False  # Set to False in production
 
+# Debug messages are formatted lazily - free when the level is above DEBUG
+logger = logging.getLogger(__name__)
+if DEBUG:
+    logging.basicConfig(format="[MEMORY DEBUG] %(message)s")
+    logger.setLevel(logging.DEBUG)
+
+# Parsed memory, reused while memory_version() is unchanged
+_MEM_CACHE = {"mtime": None, "data": None}
+
+# Required tools, recomputed only when the set of learned rules changes
+_REQUIRED_TOOLS_CACHE = {"rules": None, "tools": None}
+
+# Pipeline order, used to list missing tools in messages
+_REQUIRED_TOOL_ORDER = (
+    "search_company_overview",
+    "search_stock_price",
+    "search_recent_news",
+    "search_financial_metrics"
+)
+
+DEFAULT_REQUIRED_TOOLS = frozenset(_REQUIRED_TOOL_ORDER)
+
+# Tool outputs that were dropped start with one of these markers
+IGNORED_OUTPUT_PREFIXES = ("IGNORED", "NOT COLLECTED")
+
+
+def _loads(content: bytes):
+    """Parse JSON bytes (orjson when available)"""
+    if orjson is not None:
+        return orjson.loads(content)
+    return json.loads(content)
+
+
+def _dumps(data) -> bytes:
+    """
+    Serialize to UTF-8 JSON bytes (orjson when available).
+    Compact by default; pretty-printed when DEBUG is on.
+    """
+    if orjson is not None:
+        return orjson.dumps(data, option=orjson.OPT_INDENT_2 if DEBUG else 0)
+    if DEBUG:
+        return json.dumps(data, indent=2, ensure_ascii=False).encode("utf-8")
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def _dumps_line(data) -> bytes:
+    """Serialize to a single compact JSON line"""
+    if orjson is not None:
+        return orjson.dumps(data) + b"\n"
+    return json.dumps(data, ensure_ascii=False).encode("utf-8") + b"\n"
+
+
+def _mtime_ns(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+def memory_version():
+    """Cache key that changes whenever the stored memory changes"""
+    return (_mtime_ns(MEMORY_FILE), _mtime_ns(RUNS_FILE), _mtime_ns(MISTAKES_FILE))
+
+
+def _read_jsonl(path):
+    """All entries of a JSONL stream (empty if the file doesn't exist)"""
+    if not os.path.exists(path):
+        return []
+    
+    entries = []
+    with open(path, "rb") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            try:
+                entries.append(_loads(line))
+            except ValueError:
+                # Partially written line from an interrupted run
+                continue
+    return entries
+
+
+def _read_stream(path, total_runs):
+    """
+    Entries of a stream that MEMORY_FILE accounts for. MEMORY_FILE is written
+    last, so lines past total_runs come from a run whose save didn't finish -
+    they are dropped from the file too, so the run isn't logged twice.
+    """
+    entries = _read_jsonl(path)
+    kept = [entry for entry in entries if entry.get("run_number", 0) <= total_runs]
+    if len(kept) != len(entries):
+        logger.debug("Dropping %d unsaved entries from %s", len(entries) - len(kept), path)
+        _write_jsonl(path, kept)
+    return kept
+
+
+def _write_jsonl(path, entries):
+    _write_atomic(path, b"".join(_dumps_line(entry) for entry in entries))
+
+
+def _append_jsonl(path, entry):
+    with open(path, "ab") as f:
+        f.write(_dumps_line(entry))
+
+
+def _write_atomic(path, content: bytes):
+    """Write the whole file at once, then swap it in so readers never see a partial file"""
+    tmp_file = path + ".tmp"
+    with open(tmp_file, "wb") as f:
+        f.write(content)
+    os.replace(tmp_file, path)
+
+
+def _write_state(memory):
+    """Write MEMORY_FILE - everything except the append-only streams"""
+    state = {k: v for k, v in memory.items() if k not in _STREAM_FILES}
+    _write_atomic(MEMORY_FILE, _dumps(state))
+
+
+def _default_memory():
+    return {
+        "total_runs": 0,
+        "mistakes": [],
+        "run_history": [],
+        "learned_rules": [],
+        "aggregates": _empty_aggregates()
+    }
+
+
+def _empty_aggregates():
+    return {"mistake_counts": {}, "successful_runs": 0, "total_runs": 0}
+
+
+def _build_aggregates(memory):
+    """Rebuild aggregates for memory files written before they existed"""
+    aggregates = _empty_aggregates()
+    aggregates["mistake_counts"] = dict(
+        Counter(m.get("mistake_type", "unknown") for m in memory.get("mistakes", []))
+    )
+    aggregates["successful_runs"] = sum(
+        1 for r in memory.get("run_history", []) if r.get("success", False)
+    )
+    aggregates["total_runs"] = memory.get("total_runs", 0)
+    return aggregates
+
+
+def _apply_run(memory, run_entry, mistake_entry):
+    """Add one run (and its mistake, if any) to memory, keeping aggregates current"""
+    aggregates = memory["aggregates"]
+    
+    memory["total_runs"] = run_entry["run_number"]
+    memory["run_history"].append(run_entry)
+    del memory["run_history"][:-RUN_HISTORY_WINDOW]
+    aggregates["total_runs"] = memory["total_runs"]
+    if run_entry.get("success", False):
+        aggregates["successful_runs"] += 1
+    
+    if mistake_entry:
+        memory["mistakes"].append(mistake_entry)
+        mistake_type = mistake_entry.get("mistake_type", "unknown")
+        counts = aggregates["mistake_counts"]
+        counts[mistake_type] = counts.get(mistake_type, 0) + 1
+
 
 def count_mistake_occurrences(memory, mistake_type):
     """Count how many times a specific mistake type has occurred"""
+    aggregates = memory.get("aggregates")
+    if aggregates is not None:
+        # Kept current by _apply_run - no need to scan every mistake
+        return aggregates["mistake_counts"].get(mistake_type, 0)
+    
     mistakes = memory.get("mistakes", [])
     return sum(1 for m in mistakes if m.get("mistake_type") == mistake_type)
 
 
-def load_memory():
-    """Load memory from JSON file"""
+def load_memory(mutable=False):
+    """
+    Load memory from JSON file.
+    The returned dict is shared with the in-process cache - pass
+    mutable=True for a private copy that is safe to modify.
+    """
+    memory = _load_memory()
+    return copy.deepcopy(memory) if mutable else memory
+
+
+def _copy_for_run(memory):
+    """
+    Copy of memory that record_run can update without touching the cached
+    dict. Only the containers _apply_run and learn_from_mistake change are
+    copied - run, mistake and rule entries are shared and never modified.
+    """
+    copied = dict(memory)
+    for key in ("run_history", "mistakes", "learned_rules"):
+        copied[key] = list(memory[key])
     
-    if DEBUG:
-        print(f"[MEMORY DEBUG] Loading from: {MEMORY_FILE}")
+    aggregates = dict(memory["aggregates"])
+    aggregates["mistake_counts"] = dict(aggregates["mistake_counts"])
+    copied["aggregates"] = aggregates
+    return copied
+
+
+def _invalidate_cache():
+    _MEM_CACHE["mtime"] = None
+    _MEM_CACHE["data"] = None
+
+
+def _cache_memory(memory):
+    """Remember memory as the parsed form of what is now on disk"""
+    _MEM_CACHE["mtime"] = memory_version()
+    _MEM_CACHE["data"] = memory
+
+
+def _load_memory():
+    logger.debug("Loading from: %s", MEMORY_FILE)
     
     if not os.path.exists(MEMORY_FILE):
-        if DEBUG:
-            print(f"[MEMORY DEBUG] File doesn't exist, creating default memory")
-        default_memory = {
-            "total_runs": 0,
-            "mistakes": [],
-            "run_history": [],
-            "learned_rules": []
-        }
-        save_memory(default_memory)
-        return default_memory
+        logger.debug("File doesn't exist, using default memory")
+        # Nothing to preserve - the first record_run writes the file
+        return _default_memory()
     
     try:
-        with open(MEMORY_FILE, "r", encoding="utf-8") as f:
+        mtime = memory_version()
+        if mtime == _MEM_CACHE["mtime"]:
+            logger.debug("Cache hit, skipping parse")
+            return _MEM_CACHE["data"]
+        
+        with open(MEMORY_FILE, "rb") as f:
             content = f.read()
             if not content.strip():
-                if DEBUG:
-                    print(f"[MEMORY DEBUG] File empty, creating default memory")
-                default_memory = {
-                    "total_runs": 0,
-                    "mistakes": [],
-                    "run_history": [],
-                    "learned_rules": []
-                }
-                save_memory(default_memory)
-                return default_memory
+                logger.debug("File empty, using default memory")
+                # Nothing to preserve - the first record_run writes the file
+                return _default_memory()
             
-            data = json.loads(content)
+            data = _loads(content)
             if "learned_rules" not in data:
                 data["learned_rules"] = []
             
-            if DEBUG:
-                print(f"[MEMORY DEBUG] Loaded: {data['total_runs']} runs, {len(data.get('mistakes', []))} mistakes")
+            # Older versions kept the lists inline in MEMORY_FILE
+            legacy = "run_history" in data
+            for key, path in _STREAM_FILES.items():
+                if key not in data:
+                    data[key] = _read_stream(path, data.get("total_runs", 0))
             
+            if "aggregates" not in data:
+                data["aggregates"] = _build_aggregates(data)
+            del data["run_history"][:-RUN_HISTORY_WINDOW]
+            
+            if legacy:
+                logger.debug("Migrating memory to JSONL streams")
+                _write_all(data)
+                _cache_memory(data)
+                return data
+            
+            logger.debug("Loaded: %d runs, %d mistakes", data["total_runs"], len(data.get("mistakes", [])))
+            
+            _cache_memory(data)
             return data
     except Exception as e:
-        if DEBUG:
-            print(f"[MEMORY DEBUG] Error loading: {str(e)}")
-        default_memory = {
-            "total_runs": 0,
-            "mistakes": [],
-            "run_history": [],
-            "learned_rules": []
-        }
-        save_memory(default_memory)
-        return default_memory
+        logger.debug("Error loading: %s", e)
+        # Don't overwrite the unreadable file until a run is recorded
+        return _default_memory()
 
 
 def save_memory(memory):
-    """Save memory to JSON file"""
+    """
+    Save the full memory: rewrites the JSONL streams as well as the JSON
+    file. record_run doesn't use this - it only appends.
+    """
+    _write_all(memory)
+    
+    # Cache a private copy - the caller may keep modifying its dict
+    _cache_memory(copy.deepcopy(memory))
+
+
+def _write_all(memory):
+    """Write MEMORY_FILE and both streams (leaves the cache empty)"""
+    # Invalidate first so a failed write never leaves stale data cached
+    _invalidate_cache()
+    
     try:
-        # ⚠️ FIX: Ensure directory exists
-        os.makedirs(os.path.dirname(MEMORY_FILE) or '.', exist_ok=True)
-        
-        with open(MEMORY_FILE, "w", encoding="utf-8") as f:
-            json.dump(memory, f, indent=2, ensure_ascii=False)
+        for key, path in _STREAM_FILES.items():
+            _write_jsonl(path, memory.get(key, []))
+        _write_state(memory)
         
-        if DEBUG:
-            print(f"[MEMORY DEBUG] Saved successfully to: {MEMORY_FILE}")
-            print(f"[MEMORY DEBUG] File size: {os.path.getsize(MEMORY_FILE)} bytes")
+        logger.debug("Saved successfully to: %s", MEMORY_FILE)
         
     except Exception as e:
-        if DEBUG:
-            print(f"[MEMORY DEBUG] ❌ Error saving: {str(e)}")
+        logger.debug("❌ Error saving: %s", e)
         # Don't fail silently - raise the error
         raise
 
 
-def get_run_number():
+def get_run_number(memory=None):
     """Get the current run number"""
-    memory = load_memory()
+    if memory is None:
+        memory = load_memory()
     next_run = memory["total_runs"] + 1
     
-    if DEBUG:
-        print(f"[MEMORY DEBUG] Next run number: {next_run}")
+    logger.debug("Next run number: %d", next_run)
     
     return next_run
 
@@ -107,29 +340,26 @@ def get_run_number():
 def record_run(run_data: dict):
     """Record details of a run and extract learning"""
     
-    if DEBUG:
-        print(f"[MEMORY DEBUG] Recording run...")
-        print(f"[MEMORY DEBUG] Run data: {run_data}")
+    logger.debug("Recording run: %s", run_data)
     
-    memory = load_memory()
+    memory = _copy_for_run(load_memory())
     
     # ⚠️ FIX: Increment BEFORE recording (was causing off-by-one issues)
-    memory["total_runs"] += 1
-    current_run_num = memory["total_runs"]
+    current_run_num = memory["total_runs"] + 1
     
-    if DEBUG:
-        print(f"[MEMORY DEBUG] Recording as run #{current_run_num}")
+    logger.debug("Recording as run #%d", current_run_num)
     
-    memory["run_history"].append({
+    run_entry = {
         "run_number": current_run_num,
         "timestamp": datetime.now().isoformat(),
         "query": run_data.get("query"),
         "tools_used": run_data.get("tools_used", []),
         "success": run_data.get("success", False),
         "mistake": run_data.get("mistake")
-    })
+    }
     
     # Record mistake if present
+    mistake_entry = None
     if run_data.get("mistake"):
         mistake_entry = {
             "run_number": current_run_num,
@@ -137,22 +367,39 @@ def record_run(run_data: dict):
             "explanation": run_data.get("explanation"),
             "tools_used": run_data.get("tools_used", [])
         }
-        memory["mistakes"].append(mistake_entry)
-        
-        if DEBUG:
-            print(f"[MEMORY DEBUG] Recorded mistake: {mistake_entry['mistake_type']}")
+    
+    _apply_run(memory, run_entry, mistake_entry)
+    
+    if mistake_entry:
+        logger.debug("Recorded mistake: %s", mistake_entry["mistake_type"])
         
         # Try to learn from mistake
         learn_from_mistake(memory, mistake_entry)
     
     # ⚠️ CRITICAL: Save MUST happen before returning
-    if DEBUG:
-        print(f"[MEMORY DEBUG] Saving memory with {memory['total_runs']} runs...")
+    _invalidate_cache()
     
-    save_memory(memory)
+    if current_run_num == 1:
+        # Fresh memory (new install, or MEMORY_FILE missing/unreadable) -
+        # start the streams over so they can't disagree with MEMORY_FILE
+        _write_all(memory)
+    else:
+        # Append the new entries (O(1)), then rewrite only the small JSON file.
+        # MEMORY_FILE goes last - load ignores stream lines it doesn't count.
+        logger.debug("Appending run #%d to %s", current_run_num, RUNS_FILE)
+        
+        if current_run_num % RUN_HISTORY_WINDOW == 0:
+            # Drop runs that fell out of the window so the file stays bounded
+            _write_jsonl(RUNS_FILE, memory["run_history"])
+        else:
+            _append_jsonl(RUNS_FILE, run_entry)
+        if mistake_entry:
+            _append_jsonl(MISTAKES_FILE, mistake_entry)
+        _write_state(memory)
     
-    if DEBUG:
-        print(f"[MEMORY DEBUG] ✅ Memory saved successfully")
+    _cache_memory(memory)
+    
+    logger.debug("✅ Memory saved successfully")
 
 
 def learn_from_mistake(memory, mistake_entry):
@@ -174,14 +421,13 @@ def learn_from_mistake(memory, mistake_entry):
         if rule:
             # Check if this exact rule already exists
             existing_rules = memory.get("learned_rules", [])
-            existing_rule_types = [r.get("rule") for r in existing_rules if r]
+            existing_rule_types = {r.get("rule") for r in existing_rules if r}
             
             if rule.get("rule") not in existing_rule_types:
                 memory["learned_rules"].append(rule)
                 print(f"  ✅ Threshold reached! Created rule: {rule.get('description')}")
                 
-                if DEBUG:
-                    print(f"[MEMORY DEBUG] Rule added: {rule}")
+                logger.debug("Rule added: %s", rule)
             else:
                 print(f"  ℹ️ Rule already exists: {rule.get('description')}")
     else:
@@ -217,100 +463,109 @@ def create_learning_rule(mistake_type, mistake_entry):
     
     rule = rules.get(mistake_type)
     
-    if DEBUG and rule:
-        print(f"[MEMORY DEBUG] Created rule for {mistake_type}: {rule.get('rule')}")
+    if rule:
+        logger.debug("Created rule for %s: %s", mistake_type, rule.get("rule"))
     
     return rule
 
 
-def get_learned_rules():
-    """Get all learned rules"""
-    memory = load_memory()
+def get_learned_rules(memory=None):
+    """Get all learned rules (pass an already-loaded memory to skip the reload)"""
+    if memory is None:
+        memory = load_memory()
     rules = memory.get("learned_rules", [])
     
-    if DEBUG:
-        print(f"[MEMORY DEBUG] Retrieved {len(rules)} learned rules")
+    logger.debug("Retrieved %d learned rules", len(rules))
     
     return rules
 
 
-def should_follow_learned_behavior():
+def should_follow_learned_behavior(memory=None):
     """Check if agent has learned enough to behave correctly"""
-    memory = load_memory()
+    if memory is None:
+        memory = load_memory()
     has_rules = len(memory.get("learned_rules", [])) > 0
     
-    if DEBUG:
-        print(f"[MEMORY DEBUG] Has learned behavior: {has_rules}")
+    logger.debug("Has learned behavior: %s", has_rules)
     
     return has_rules
 
 
-def get_required_tools():
-    """Get list of required tools based on learned rules"""
-    rules = get_learned_rules()
-    required = []
+def get_required_tools(memory=None):
+    """Get the set of required tools based on learned rules"""
+    rules = get_learned_rules(memory)
+    rule_names = tuple(rule.get("rule") for rule in rules if rule)
     
+    if rule_names == _REQUIRED_TOOLS_CACHE["rules"]:
+        return _REQUIRED_TOOLS_CACHE["tools"]
+    
+    required = set()
     for rule in rules:
         if rule and rule.get("required_tools"):
-            required.extend(rule["required_tools"])
+            required.update(rule["required_tools"])
     
     # Default required tools if nothing learned yet
-    if not required:
-        required = [
-            "search_company_overview",
-            "search_stock_price", 
-            "search_recent_news",
-            "search_financial_metrics"
-        ]
+    required_tools = frozenset(required) or DEFAULT_REQUIRED_TOOLS
     
-    unique_required = list(set(required))
-    return unique_required
+    _REQUIRED_TOOLS_CACHE["rules"] = rule_names
+    _REQUIRED_TOOLS_CACHE["tools"] = required_tools
+    return required_tools
 
 
 def validate_execution(tools_used, tool_outputs):
     """Validate if execution followed learned rules"""
-    rules = get_learned_rules()
+    memory = load_memory()
+    rules = get_learned_rules(memory)
     
     if not rules:
         return True, None, None
     
-    required_tools = get_required_tools()
+    required_tools = get_required_tools(memory)
     
     # Check 1: All required tools used?
-    missing_tools = [t for t in required_tools if t not in tools_used]
+    missing = required_tools - set(tools_used)
+    missing_tools = [tool for tool in _REQUIRED_TOOL_ORDER if tool in missing]
+    missing_tools += sorted(missing.difference(_REQUIRED_TOOL_ORDER))  # Tools from hand-edited rules
     if missing_tools:
         return False, "skipped_required_tool", f"Missing tools: {', '.join(missing_tools)}"
     
     # Check 2: generate_report called last?
-    if "generate_report" in tools_used:
-        report_index = tools_used.index("generate_report")
-        if report_index != len(tools_used) - 1:
-            return False, "wrong_tool_sequence", "generate_report should be called last"
-    
-    # Check 3: Any outputs ignored?
-    for key, value in tool_outputs.items():
-        if isinstance(value, str) and ("IGNORED" in value or "NOT COLLECTED" in value):
-            return False, "ignored_tool_outputs", f"Tool output was ignored: {key}"
+    if "generate_report" in tools_used and tools_used[-1] != "generate_report":
+        return False, "wrong_tool_sequence", "generate_report should be called last"
+    
+    # Check 3: Any outputs ignored? (prefix check, stops at the first one)
+    ignored_key = next(
+        (key for key, value in tool_outputs.items()
+         if isinstance(value, str) and value.startswith(IGNORED_OUTPUT_PREFIXES)),
+        None
+    )
+    if ignored_key is not None:
+        return False, "ignored_tool_outputs", f"Tool output was ignored: {ignored_key}"
 
     return True, None, None
 
 
-def get_past_mistakes():
+def get_past_mistakes(memory=None):
     """Get list of past mistakes"""
-    memory = load_memory()
+    if memory is None:
+        memory = load_memory()
     return memory.get("mistakes", [])
 
 
-def analyze_patterns():
+def analyze_patterns(memory=None):
     """Analyze mistake patterns to generate learning insights"""
-    memory = load_memory()
-    mistakes = memory.get("mistakes", [])
+    if memory is None:
+        memory = load_memory()
     
-    if not mistakes:
-        return []
+    # Count mistake types (maintained incrementally by record_run)
+    aggregates = memory.get("aggregates")
+    if aggregates is not None:
+        mistake_counts = aggregates["mistake_counts"]
+    else:
+        mistake_counts = Counter(m.get("mistake_type", "unknown") for m in memory.get("mistakes", []))
     
-    # Count mistake types
-    mistake_counts = Counter(m.get("mistake_type", "unknown") for m in mistakes)
+    if not mistake_counts:
+        return []
     
     # Generate insights
     insights = []
@@ -328,10 +583,14 @@ def analyze_patterns():
 
 def reset_memory():
     """Reset memory (useful for testing)"""
+    _invalidate_cache()
+    
+    for path in _STREAM_FILES.values():
+        if os.path.exists(path):
+            os.remove(path)
+    
     if os.path.exists(MEMORY_FILE):
         os.remove(MEMORY_FILE)
-        if DEBUG:
-            print(f"[MEMORY DEBUG] Memory file deleted: {MEMORY_FILE}")
+        logger.debug("Memory file deleted: %s", MEMORY_FILE)
     else:
-        if DEBUG:
-            print(f"[MEMORY DEBUG] No memory file to delete")
\ No newline at end of file
+        logger.debug("No memory file to delete")
\ No newline at end of file
@@ -1,23 +1,28 @@
 from typing import List, Optional, Dict,Any
-from typing_extensions import TypedDict
+from dataclasses import dataclass, field, fields
 
-class AgentState(TypedDict):
+@dataclass(slots=True)
+class AgentState:
     user_query: str
 
-    run_number: int
-    should_make_mistake: bool
+    run_number: int = 0
+    should_make_mistake: bool = False
     
     # Tool execution tracking
-    tools_used: List[str]
-    tool_outputs: Dict[str, Any]
+    tools_used: List[str] = field(default_factory=list)
+    tool_outputs: Dict[str, Any] = field(default_factory=dict)
     
     # Results
-    final_report: Optional[str]
-    success: bool
+    final_report: Optional[str] = None
+    success: bool = False
     
     # Error tracking
-    mistake_type: Optional[str]
-    mistake_explanation: Optional[str]
+    mistake_type: Optional[str] = None
+    mistake_explanation: Optional[str] = None
     
     # Memory
-    past_mistakes: List[str]
+    past_mistakes: List[str] = field(default_factory=list)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Plain mapping of the fields (shallow - values are not copied)"""
+        return {f.name: getattr(self, f.name) for f in fields(self)}
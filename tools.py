@@ -1,7 +1,12 @@
 from langchain.tools import tool
 from tavily import TavilyClient
 from langchain_groq import ChatGroq
+from langchain_core.runnables.config import ContextThreadPoolExecutor
+from collections import OrderedDict
+import hashlib
 import os
+import threading
+import time
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -14,6 +19,75 @@ llm = ChatGroq(
     api_key=os.getenv("GROQ_API_KEY")
 )
 
+# Tavily responses, reused for repeated queries (bounded LRU with expiry).
+# This is the only search cache - graph.py calls the tools directly.
+SEARCH_CACHE_SIZE = 256
+SEARCH_CACHE_TTL = 900  # seconds
+_search_cache = OrderedDict()  # (normalized query, max_results) -> (fetched_at, results)
+_search_cache_lock = threading.Lock()
+
+
+def _cached_search(query: str, max_results: int) -> dict:
+    """
+    tavily.search with a TTL-bounded LRU cache. A failed search raises before
+    anything is stored, so the tool's "Could not fetch data" output is never cached.
+    """
+    # Case/whitespace-insensitive key, so "Tesla " and "tesla" share a cached
+    # search - the request itself still uses the original text
+    key = (" ".join(query.lower().split()), max_results)
+    now = time.monotonic()
+    
+    with _search_cache_lock:
+        hit = _search_cache.get(key)
+        if hit is not None and now - hit[0] < SEARCH_CACHE_TTL:
+            _search_cache.move_to_end(key)
+            return hit[1]
+    
+    # Only the snippet content is used - never ask for the full page text
+    results = tavily.search(
+        query=query,
+        max_results=max_results,
+        search_depth="basic",
+        include_raw_content=False
+    )
+    
+    with _search_cache_lock:
+        _search_cache[key] = (now, results)
+        _search_cache.move_to_end(key)
+        while len(_search_cache) > SEARCH_CACHE_SIZE:
+            _search_cache.popitem(last=False)
+    
+    return results
+
+
+# LLM responses keyed by prompt digest - the client runs at temperature 0,
+# so an identical prompt (e.g. a retry on the same data) gives the same answer
+LLM_CACHE_SIZE = 256
+_llm_cache = OrderedDict()  # prompt digest -> response content
+_llm_cache_lock = threading.Lock()
+
+
+def _invoke_llm(prompt: str) -> str:
+    """llm.invoke(prompt).content, memoized on the prompt text (bounded LRU)"""
+    key = hashlib.blake2b(prompt.encode("utf-8"), digest_size=16).hexdigest()
+    
+    with _llm_cache_lock:
+        cached = _llm_cache.get(key)
+        if cached is not None:
+            _llm_cache.move_to_end(key)
+            return cached
+    
+    content = llm.invoke(prompt).content
+    
+    with _llm_cache_lock:
+        _llm_cache[key] = content
+        _llm_cache.move_to_end(key)
+        while len(_llm_cache) > LLM_CACHE_SIZE:
+            _llm_cache.popitem(last=False)
+    
+    return content
+
+
 @tool
 def search_company_overview(company: str) -> str:
     """
@@ -21,9 +95,9 @@ def search_company_overview(company: str) -> str:
     This must be called to understand what the company does.
     """
     try:
-        results = tavily.search(
+        results = _cached_search(
             query=f"{company} company overview business",
-            max_results=2
+            max_results=1
         )
         content = results["results"][0]["content"][:300]
         return f"Overview: {content}"
@@ -38,9 +112,9 @@ def search_stock_price(company: str) -> str:
     Must be called before making investment recommendations.
     """
     try:
-        results = tavily.search(
+        results = _cached_search(
             query=f"{company} stock price current today",
-            max_results=2
+            max_results=1
         )
         content = results["results"][0]["content"][:200]
         return f"Stock Price Info: {content}"
@@ -55,7 +129,7 @@ def search_recent_news(company: str) -> str:
     Essential for understanding current events affecting the stock.
     """
     try:
-        results = tavily.search(
+        results = _cached_search(
             query=f"{company} latest news recent",
             max_results=3
         )
@@ -72,9 +146,9 @@ def search_financial_metrics(company: str) -> str:
     Must check financial metrics before investment advice.
     """
     try:
-        results = tavily.search(
+        results = _cached_search(
             query=f"{company} financial metrics revenue profit PE ratio",
-            max_results=2
+            max_results=1
         )
         content = results["results"][0]["content"][:250]
         return f"Financial Metrics: {content}"
@@ -82,6 +156,37 @@ def search_financial_metrics(company: str) -> str:
         return f"Financial Metrics: Could not fetch data - {str(e)}"
 
 
+# Search tools whose output depends only on the company
+SEARCH_TOOLS = {
+    "search_company_overview": search_company_overview,
+    "search_stock_price": search_stock_price,
+    "search_recent_news": search_recent_news,
+    "search_financial_metrics": search_financial_metrics
+}
+
+
+def gather_company_data(company: str, tool_names=None) -> dict:
+    """
+    Run independent search tools concurrently so the Tavily round-trips
+    overlap. Returns {tool_name: output}.
+    """
+    if tool_names is None:
+        tool_names = list(SEARCH_TOOLS)
+    if not tool_names:
+        return {}
+    
+    if len(tool_names) == 1:
+        return {tool_names[0]: SEARCH_TOOLS[tool_names[0]].invoke(company)}
+    
+    # Workers only run the plain tools - nothing here touches Streamlit.
+    # The context-copying pool keeps each call nested under the caller's run.
+    with ContextThreadPoolExecutor(max_workers=len(SEARCH_TOOLS)) as pool:
+        futures = {
+            name: pool.submit(SEARCH_TOOLS[name].invoke, company) for name in tool_names
+        }
+        return {name: future.result() for name, future in futures.items()}
+
+
 @tool
 def analyze_sentiment(news_text: str) -> str:
     """
@@ -94,25 +199,19 @@ def analyze_sentiment(news_text: str) -> str:
     
     Respond with only one word: Positive, Negative, or Neutral
     """
-    response = llm.invoke(prompt)
-    sentiment = response.content.strip()
+    sentiment = _invoke_llm(prompt).strip()
     return f"Sentiment Analysis: {sentiment}"
 
 
-@tool
-def generate_report(company: str, collected_data: dict) -> str:
-    """
-    FINAL TOOL: Generate investment recommendation.
-    Should only be called after collecting all required data.
-    """
-    prompt = f"""
+# Report prompt - filled with format_map, so identical data gives an identical prompt
+_REPORT_TEMPLATE = """
     Create a brief investment analysis for {company} based on:
     
-    {collected_data.get('overview', 'NOT PROVIDED')}
-    {collected_data.get('price', 'NOT PROVIDED')}
-    {collected_data.get('news', 'NOT PROVIDED')}
-    {collected_data.get('financials', 'NOT PROVIDED')}
-    {collected_data.get('sentiment', 'NOT PROVIDED (optional)')}
+    {overview}
+    {price}
+    {news}
+    {financials}
+    {sentiment}
     
     Provide:
     1. Brief Summary (2 sentences)
@@ -121,6 +220,25 @@ def generate_report(company: str, collected_data: dict) -> str:
     
     Keep it under 150 words.
     """
+
+# Placeholder text for sections missing from collected_data
+_REPORT_DEFAULTS = {
+    "overview": "NOT PROVIDED",
+    "price": "NOT PROVIDED",
+    "news": "NOT PROVIDED",
+    "financials": "NOT PROVIDED",
+    "sentiment": "NOT PROVIDED (optional)"
+}
+
+
+@tool
+def generate_report(company: str, collected_data: dict) -> str:
+    """
+    FINAL TOOL: Generate investment recommendation.
+    Should only be called after collecting all required data.
+    """
+    prompt = _REPORT_TEMPLATE.format_map(
+        {**_REPORT_DEFAULTS, **collected_data, "company": company}
+    )
     
-    response = llm.invoke(prompt)
-    return response.content
\ No newline at end of file
+    return _invoke_llm(prompt)
\ No newline at end of file